@@ -0,0 +1,443 @@
+import argparse
+import hashlib
+import mmap
+import os
+import random
+import struct
+from collections import deque
+from itertools import combinations, permutations
+
+# Cards are packed as suit_index * 13 + rank_value, using the same suit and
+# rank order as Solitaire. Face-down cards carry the FACE_DOWN flag.
+SUITS = ['♥', '♦', '♣', '♠']
+RANKS = ['A', '2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K']
+FACE_DOWN = 64
+KING = 12
+
+DEFAULT_PATH = 'endgame.tb'
+DEFAULT_MAX_CARDS = 6
+# Every extra card multiplies the build time and memory by about eleven, and
+# solve() holds the whole table in memory: 6 cards is about 420,000 positions,
+# a 14 MB file and under a minute, 7 cards would already need several GB.
+MAX_SUPPORTED_CARDS = 6
+# A position key is one byte per card plus one separator byte between piles
+KEY_SIZE = 16
+SEPARATOR = 0xFF
+# No win is found, but the position can reach one with more than max_cards
+# cards in play, so the search was cut off and the result is not proven
+UNKNOWN = 254
+LOSS = 255
+
+MAGIC = b'SOLTB\x00\x03\x00'
+HEADER = struct.Struct('<8sIIQQ8s')  # magic, max_cards, reserved, slots, entries, digest
+SLOT = struct.Struct('<16sB')  # position key, distance to win, UNKNOWN or LOSS
+
+
+def pack_card(card):
+    value = SUITS.index(card.suit) * 13 + RANKS.index(card.rank)
+    return value if card.visible else value | FACE_DOWN
+
+
+def _is_red(card_id):
+    return (card_id & ~FACE_DOWN) // 13 < 2
+
+
+def _can_stack(card_id, target_id):
+    """Same rule as Solitaire.can_place_on_tableau, on packed cards"""
+    return (_is_red(card_id) != _is_red(target_id) and
+            card_id % 13 == target_id % 13 - 1)
+
+
+def _heights(piles):
+    """Foundation heights per suit, derived from the cards still in play"""
+    heights = [13, 13, 13, 13]
+    for pile in piles:
+        for card_id in pile:
+            heights[(card_id & ~FACE_DOWN) // 13] -= 1
+    return heights
+
+
+def _with_flip(pile):
+    """Turn the new top card face-up after cards were taken off a pile"""
+    if pile and pile[-1] & FACE_DOWN:
+        return pile[:-1] + (pile[-1] & ~FACE_DOWN,)
+    return pile
+
+
+def canonical(piles):
+    """Canonical form of a tableau: empty piles dropped, the rest sorted"""
+    return tuple(sorted(pile for pile in piles if pile))
+
+
+def encode(position):
+    """Pack a canonical position into a fixed-size key"""
+    data = bytearray()
+    for pile in position:
+        if data:
+            data.append(SEPARATOR)
+        data.extend(card_id + 1 for card_id in pile)
+    return bytes(data).ljust(KEY_SIZE, b'\x00')
+
+
+def generate_moves(piles):
+    """
+    Yields (source, destination, piles) for every endgame move.
+    Sources and destinations are pile indexes, 'f' means a foundation.
+    """
+    piles = list(piles) + [()] * (7 - len(piles))
+    heights = _heights(piles)
+    for src, pile in enumerate(piles):
+        if not pile:
+            continue
+
+        top = pile[-1]
+        if top % 13 == heights[top // 13]:
+            new_piles = list(piles)
+            new_piles[src] = _with_flip(pile[:-1])
+            yield src, 'f', new_piles
+
+        # Every face-up run ending at the top of the pile may move as a unit
+        start = len(pile) - 1
+        while start > 0 and not pile[start - 1] & FACE_DOWN:
+            start -= 1
+        for i in range(start, len(pile)):
+            run = pile[i:]
+            moved_to_empty = False
+            for dest, target in enumerate(piles):
+                if dest == src:
+                    continue
+                if target:
+                    if not _can_stack(run[0], target[-1]):
+                        continue
+                else:
+                    # A King already at the bottom gains nothing from moving,
+                    # and all empty piles are equivalent
+                    if run[0] % 13 != KING or i == 0 or moved_to_empty:
+                        continue
+                    moved_to_empty = True
+                new_piles = list(piles)
+                new_piles[src] = _with_flip(pile[:i])
+                new_piles[dest] = target + run
+                yield src, dest, new_piles
+
+    # The top card of each foundation may come back down onto the tableau
+    for suit in range(4):
+        if heights[suit] == 0:
+            continue
+        card_id = suit * 13 + heights[suit] - 1
+        moved_to_empty = False
+        for dest, target in enumerate(piles):
+            if target:
+                if not _can_stack(card_id, target[-1]):
+                    continue
+            else:
+                if card_id % 13 != KING or moved_to_empty:
+                    continue
+                moved_to_empty = True
+            new_piles = list(piles)
+            new_piles[dest] = target + (card_id,)
+            yield 'f', dest, new_piles
+
+
+def _pile_variants(order):
+    """Every legal face-down/face-up split of one pile with cards in this order"""
+    split = len(order) - 1
+    while True:
+        yield tuple(c | FACE_DOWN for c in order[:split]) + order[split:]
+        if split == 0 or not _can_stack(order[split], order[split - 1]):
+            break
+        split -= 1
+
+
+def _positions(remaining, piles):
+    if not remaining:
+        yield canonical(piles)
+        return
+    if len(piles) == 7:
+        return
+
+    first, rest = remaining[0], remaining[1:]
+    for size in range(len(rest) + 1):
+        for others in combinations(rest, size):
+            left = tuple(c for c in rest if c not in others)
+            for order in permutations((first,) + others):
+                for pile in _pile_variants(order):
+                    yield from _positions(left, piles + [pile])
+
+
+def enumerate_positions(card_count):
+    """All legal tableaus holding exactly card_count cards, stock and waste empty"""
+    for heights in _height_splits(card_count):
+        remaining = tuple(suit * 13 + value
+                          for suit in range(4)
+                          for value in range(heights[suit], 13))
+        yield from _positions(remaining, [])
+
+
+def _height_splits(card_count, suit=0):
+    if suit == 3:
+        if card_count <= 13:
+            yield [13 - card_count]
+        return
+    for left in range(min(card_count, 13) + 1):
+        for rest in _height_splits(card_count - left, suit + 1):
+            yield [13 - left] + rest
+
+
+def _card_count(position):
+    return sum(len(pile) for pile in position)
+
+
+def solve(max_cards, progress=None):
+    """
+    Retrograde solve of every endgame with up to max_cards cards left.
+    Returns a dict mapping canonical positions to distance-to-win, UNKNOWN or LOSS.
+
+    Moves from the foundations add a card, so a position can lead out of the
+    table. Distances are the shortest wins that never exceed max_cards cards,
+    and a position without such a win is only a LOSS if it cannot leave the table.
+    """
+    positions = [()]
+    for card_count in range(1, max_cards + 1):
+        before = len(positions)
+        positions.extend(enumerate_positions(card_count))
+        if progress:
+            progress(card_count, len(positions) - before)
+    index = {position: i for i, position in enumerate(positions)}
+
+    predecessors = [[] for _ in positions]
+    escapes = []
+    for i, position in enumerate(positions):
+        if not position:
+            continue
+        for _, _, new_piles in generate_moves(position):
+            child = canonical(new_piles)
+            j = index.get(child)
+            if j is None:
+                if _card_count(child) <= max_cards:
+                    raise RuntimeError(f"Move leads to an unknown position: {child}")
+                escapes.append(i)
+            elif j != i:
+                predecessors[j].append(i)
+
+    # Every move costs one, so a backwards breadth-first search from the won
+    # position gives the shortest distances
+    distances = [LOSS] * len(positions)
+    distances[0] = 0
+    queue = deque([0])
+    while queue:
+        i = queue.popleft()
+        for parent in predecessors[i]:
+            if distances[parent] == LOSS:
+                if distances[i] + 1 >= UNKNOWN:
+                    raise ValueError("Distance to win does not fit in the table")
+                distances[parent] = distances[i] + 1
+                queue.append(parent)
+
+    # Anything that can reach a move out of the table is not a proven loss
+    queue = deque()
+    for i in escapes:
+        if distances[i] == LOSS:
+            distances[i] = UNKNOWN
+            queue.append(i)
+    while queue:
+        i = queue.popleft()
+        for parent in predecessors[i]:
+            if distances[parent] == LOSS:
+                distances[parent] = UNKNOWN
+                queue.append(parent)
+
+    return dict(zip(positions, distances))
+
+
+def search(piles, max_cards):
+    """
+    Forward breadth-first search of one position, independent of the tablebase.
+    Gives the value the table should hold when built with max_cards.
+    """
+    start = canonical(piles)
+    seen = {start: 0}
+    queue = deque([start])
+    escaped = False
+    while queue:
+        position = queue.popleft()
+        if not position:
+            return seen[position]
+        for _, _, new_piles in generate_moves(position):
+            child = canonical(new_piles)
+            if _card_count(child) > max_cards:
+                escaped = True
+            elif child not in seen:
+                seen[child] = seen[position] + 1
+                queue.append(child)
+    return UNKNOWN if escaped else LOSS
+
+
+def check_tablebase(tablebase, samples, seed=0):
+    """
+    Compares random positions of every size against search().
+    Returns a list of (position, table value, search value) mismatches.
+    """
+    rng = random.Random(seed)
+    mismatches = []
+    for card_count in range(1, tablebase.max_cards + 1):
+        positions = list(enumerate_positions(card_count))
+        for position in rng.sample(positions, min(samples, len(positions))):
+            expected = search(position, tablebase.max_cards)
+            found = tablebase.probe(position)
+            if found != expected:
+                mismatches.append((position, found, expected))
+    return mismatches
+
+
+def _slot_index(key, slots):
+    digest = hashlib.blake2b(key, digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % slots
+
+
+def build_tablebase(path=DEFAULT_PATH, max_cards=DEFAULT_MAX_CARDS, progress=None):
+    """Solve all endgames and write them as an open-addressing hash table"""
+    if not 1 <= max_cards <= MAX_SUPPORTED_CARDS:
+        raise ValueError(f"max_cards must be between 1 and {MAX_SUPPORTED_CARDS}")
+
+    table = solve(max_cards, progress)
+    del table[()]
+
+    # Keep the load factor at or below one half so probes stay short
+    slots = max(1, len(table) * 2)
+    data = bytearray(HEADER.size + slots * SLOT.size)
+    for position, distance in table.items():
+        key = encode(position)
+        index = _slot_index(key, slots)
+        while data[HEADER.size + index * SLOT.size] != 0:
+            index = (index + 1) % slots
+        SLOT.pack_into(data, HEADER.size + index * SLOT.size, key, distance)
+
+    # The digest changes whenever any result does, so caches can tell rebuilds apart
+    digest = hashlib.blake2b(memoryview(data)[HEADER.size:], digest_size=8).digest()
+    HEADER.pack_into(data, 0, MAGIC, max_cards, 0, slots, len(table), digest)
+
+    # Write next to the target and swap in, so readers never map a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return len(table)
+
+
+class EndgameTablebase:
+    """
+    Read-only view of a tablebase file. The file is memory-mapped, so every
+    process using it shares the same pages through the OS page cache.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm.size() < HEADER.size:
+            self.mm.close()
+            raise ValueError(f"Not an endgame tablebase: {path}")
+        magic, self.max_cards, _, self.slots, self.entries, digest = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or self.mm.size() != HEADER.size + self.slots * SLOT.size:
+            self.mm.close()
+            raise ValueError(f"Not an endgame tablebase: {path}")
+        # Identifies the format and contents, for caches built on top of the table
+        self.version = f"{MAGIC.hex()}-{digest.hex()}"
+
+    def close(self):
+        self.mm.close()
+
+    def probe(self, piles):
+        """
+        Distance to win for a tableau (list of packed piles), LOSS if it cannot
+        be won, UNKNOWN if that is not proven, or None if the position is not
+        covered by the table
+        """
+        position = canonical(piles)
+        if not position:
+            return 0
+        if sum(len(pile) for pile in position) > self.max_cards:
+            return None
+
+        key = encode(position)
+        index = _slot_index(key, self.slots)
+        # A damaged file may have no empty slot, so never probe more than all of them
+        for _ in range(self.slots):
+            slot_key, distance = SLOT.unpack_from(self.mm, HEADER.size + index * SLOT.size)
+            if slot_key == key:
+                return distance
+            if slot_key[0] == 0:
+                return None
+            index = (index + 1) % self.slots
+        return None
+
+    def game_piles(self, game):
+        """Packed tableau of a game, or None if it is not an endgame position"""
+        if game.stock or game.waste:
+            return None
+        return [tuple(pack_card(card) for card in pile) for pile in game.tableau]
+
+    def probe_game(self, game):
+        piles = self.game_piles(game)
+        if piles is None:
+            return None
+        return self.probe(piles)
+
+    def best_line(self, piles):
+        """
+        Shortest winning line from a tableau as (card, target) pairs, where the
+        target is 'f' for a foundation, 'empty' for an empty pile or the card
+        moved onto. Cards may also come from a foundation. Returns None if no
+        win is proven, or if the table does not lead to one.
+        """
+        distance = self.probe(piles)
+        if distance is None or distance >= UNKNOWN:
+            return None
+
+        piles = list(piles) + [()] * (7 - len(piles))
+        line = []
+        while distance:
+            for src, dest, new_piles in generate_moves(piles):
+                if self.probe(new_piles) == distance - 1:
+                    break
+            else:
+                return None
+            if dest == 'f':
+                line.append((piles[src][-1], 'f'))
+            elif piles[dest]:
+                line.append((new_piles[dest][len(piles[dest])], piles[dest][-1]))
+            else:
+                line.append((new_piles[dest][0], 'empty'))
+            piles = new_piles
+            distance -= 1
+        return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the Solitaire endgame tablebase")
+    parser.add_argument('--path', default=DEFAULT_PATH, help="output file")
+    parser.add_argument('--max-cards', type=int, default=DEFAULT_MAX_CARDS,
+                        help="solve positions with up to this many cards off the foundations")
+    parser.add_argument('--check', type=int, default=0, metavar='N',
+                        help="compare N random positions per card count against a brute-force search")
+    args = parser.parse_args()
+
+    def progress(card_count, positions):
+        print(f"{card_count} card(s): {positions} positions")
+
+    entries = build_tablebase(args.path, args.max_cards, progress)
+    print(f"Wrote {entries} positions to {args.path}")
+
+    if args.check:
+        tablebase = EndgameTablebase(args.path)
+        mismatches = check_tablebase(tablebase, args.check)
+        tablebase.close()
+        for position, found, expected in mismatches:
+            print(f"Mismatch {position}: table {found}, search {expected}")
+        if mismatches:
+            raise SystemExit(1)
+        print("Check passed")
+
+
+if __name__ == "__main__":
+    main()
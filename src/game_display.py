@@ -163,6 +163,8 @@ class GameDisplay:
             ("d", "Draw card"),
             ("m", "Move card"),
             ("u", "Undo move"),
+            ("h", "Hint"),
+            ("a", "Autoplay"),
             ("n", "New game"),
             ("q", "Quit")
         ]
@@ -37,6 +37,45 @@ class MoveHandler:
 
         return None, None
 
+    def get_codes_for_move(self, card_name, target):
+        """
+        Converts a move given by card names (e.g. 'Q♠' onto 'K♥') into pile codes.
+        The card may be in the tableau or on top of a foundation.
+        The target is a card name, 'f' for a foundation or 'empty' for an empty tableau pile.
+        Returns a tuple: (source_code, dest_code) or (None, None) if not found
+        """
+        source_code = None
+        for i, pile in enumerate(self.game.tableau):
+            for card in pile:
+                if card.visible and f"{card.rank}{card.suit}" == card_name:
+                    source_code = f"t{i + 1}"
+        for i, foundation in enumerate(self.game.foundations):
+            if foundation and f"{foundation[-1].rank}{foundation[-1].suit}" == card_name:
+                source_code = f"f{i + 1}"
+        if source_code is None:
+            return None, None
+
+        if target == 'f':
+            if not source_code.startswith('t'):
+                return None, None
+            # Only the top card can go to a foundation
+            card = self.game.tableau[int(source_code[1:]) - 1][-1]
+            if f"{card.rank}{card.suit}" != card_name:
+                return None, None
+            for i, foundation in enumerate(self.game.foundations):
+                if self.game.can_place_on_foundation(card, foundation):
+                    return source_code, f"f{i + 1}"
+        elif target == 'empty':
+            for i, pile in enumerate(self.game.tableau):
+                if not pile:
+                    return source_code, f"t{i + 1}"
+        else:
+            for i, pile in enumerate(self.game.tableau):
+                if pile and f"{pile[-1].rank}{pile[-1].suit}" == target:
+                    return source_code, f"t{i + 1}"
+
+        return None, None
+
     def move_card(self, source_code, dest_code):
         """
         Move card(s) from source to destination
@@ -2,6 +2,9 @@ from src.card import Card
 from src.deck import Deck
 from src.game_display import GameDisplay
 from src.move_handler import MoveHandler
+from src.endgame import EndgameTablebase, DEFAULT_PATH as TABLEBASE_PATH, LOSS, UNKNOWN
+from src.solve_cache import (SolveCache, DEFAULT_PATH as SOLVE_CACHE_PATH, RESULT_WIN, RESULT_LOSS,
+                             card_label, state_key)
 import os
 import json
 
@@ -22,6 +25,8 @@ class Solitaire:
         self.move_count = 0
         self.move_history = []
         self.leaderboard = self.load_leaderboard()
+        self.tablebase = self.load_tablebase()
+        self.solve_cache = self.load_solve_cache()
 
         self.deck = Deck()
         self.display = GameDisplay(self)
@@ -40,6 +45,20 @@ class Solitaire:
         with open('../leaderboard.json', 'w') as f:
             json.dump(self.leaderboard, f)
 
+    def load_tablebase(self):
+        # The tablebase is optional, build it with: python -m src.endgame
+        if os.path.exists(TABLEBASE_PATH):
+            try:
+                return EndgameTablebase(TABLEBASE_PATH)
+            except (OSError, ValueError):
+                return None
+        return None
+
+    def load_solve_cache(self):
+        # Cached results come from the tablebase, so a rebuilt table clears them
+        version = self.tablebase.version if self.tablebase else None
+        return SolveCache(SOLVE_CACHE_PATH, version)
+
     def select_difficulty(self):
         self.difficulty = self.display.get_difficulty()
 
@@ -174,6 +193,87 @@ class Solitaire:
         return (card.suit == top_card.suit and
                 self.get_card_value(card.rank) == self.get_card_value(top_card.rank) + 1)
 
+    def solve_position(self):
+        """
+        Proven result and best line for the current position, as (result, line),
+        or None if it has not been solved. Results are shared through the solve cache.
+        """
+        key = state_key(self)
+        cached = self.solve_cache.get(key)
+        if cached:
+            return cached
+
+        if not self.tablebase:
+            return None
+        piles = self.tablebase.game_piles(self)
+        if piles is None:
+            return None
+
+        distance = self.tablebase.probe(piles)
+        if distance is None or distance == UNKNOWN:
+            return None
+        if distance == LOSS:
+            solved = (RESULT_LOSS, [])
+        else:
+            line = self.tablebase.best_line(piles)
+            if line is None:
+                return None
+            solved = (RESULT_WIN, [(card_label(card), target if target in ('f', 'empty') else card_label(target))
+                                   for card, target in line])
+
+        self.solve_cache.put(key, *solved)
+        return solved
+
+    def unsolved_reason(self):
+        """Explain why solve_position() found no result"""
+        if not self.tablebase:
+            return "endgame tablebase not found"
+        if self.tablebase.probe_game(self) is None:
+            return "the endgame has not been reached"
+        return "no proven result for this position"
+
+    def get_hint(self):
+        """Suggest the next move from the solved position"""
+        solved = self.solve_position()
+        if solved is None:
+            return f"No hint available: {self.unsolved_reason()}"
+
+        result, line = solved
+        if result == RESULT_LOSS:
+            return "This position cannot be won"
+        if not line:
+            return "No moves left to suggest"
+
+        source, dest = self.move_handler.get_codes_for_move(*line[0])
+        if source is None:
+            return "No hint available: the stored line does not match this position"
+        return f"Move {source} to {dest} ({len(line)} move(s) to win)"
+
+    def autoplay(self):
+        """Play the game out to a win along the best known line"""
+        solved = self.solve_position()
+        if solved is None:
+            return f"Autoplay unavailable: {self.unsolved_reason()}"
+
+        result, line = solved
+        if result == RESULT_LOSS:
+            return "This position cannot be won"
+
+        for played, (card_name, target) in enumerate(line):
+            source, dest = self.move_handler.get_codes_for_move(card_name, target)
+            if source is None:
+                return f"Autoplay stopped after {played} move(s): cannot play {card_name} as stored"
+
+            # A move that fails is not recorded, so the move count stays the same
+            move_count = self.move_count
+            result = self.move_handler.move_card(source, dest)
+            if self.move_count == move_count:
+                return f"Autoplay stopped after {played} move(s): {result}"
+
+        if not self.check_win():
+            return f"Autoplay stopped after {len(line)} move(s) without winning"
+        return f"Autoplay finished the game in {len(line)} move(s)"
+
     def check_win(self):
         # Check if all foundations have King as top card
         return all(pile and pile[-1].rank == 'K' for pile in self.foundations)
@@ -210,10 +310,19 @@ class Solitaire:
                 result = self.undo_last_move()
                 self.display.display_move_result(result)
                 self.display.prompt_continue()
+            elif command == 'h':
+                self.display.display_move_result(self.get_hint())
+                self.display.prompt_continue()
+            elif command == 'a':
+                self.display.display_move_result(self.autoplay())
+                self.display.prompt_continue()
             elif command == 'n':
                 if self.display.confirm_new_game():
                     self.init_game()
 
+        # Write out pending cache bookkeeping before the game exits
+        self.solve_cache.close()
+
         if self.check_win():
             self.update_leaderboard()
             self.display.display_win_message(self.move_count, self.leaderboard[self.difficulty])
\ No newline at end of file
@@ -0,0 +1,245 @@
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+
+from src.endgame import SUITS, RANKS, FACE_DOWN, pack_card, canonical
+
+DEFAULT_PATH = 'solve_cache.db'
+DEFAULT_MAX_ENTRIES = 100000
+DEFAULT_MEMORY_ENTRIES = 1000
+# The game waits on this, so give up quickly if another process holds the lock
+LOCK_TIMEOUT = 0.5
+# Reads are recorded in memory and written to disk in batches
+TOUCH_INTERVAL = 5.0
+TOUCH_BATCH = 100
+SCHEMA_NAMES = {'solved', 'solved_last_used', 'meta', 'solved_count_insert', 'solved_count_delete'}
+
+RESULT_WIN = 'win'
+RESULT_LOSS = 'loss'
+
+
+def card_label(card_id):
+    """Readable name of a packed card, e.g. 'Q♠'"""
+    card_id &= ~FACE_DOWN
+    return f"{RANKS[card_id % 13]}{SUITS[card_id // 13]}"
+
+
+def state_key(game):
+    """
+    Canonical key of a game position. Tableau piles are sorted and foundations
+    are reduced to one height per suit, so positions that differ only in pile
+    order share a key.
+    """
+    heights = [0, 0, 0, 0]
+    for pile in game.foundations:
+        for card in pile:
+            heights[SUITS.index(card.suit)] += 1
+
+    piles = canonical(tuple(pack_card(card) for card in pile) for pile in game.tableau)
+    return json.dumps([
+        game.difficulty,
+        heights,
+        piles,
+        [pack_card(card) for card in game.stock],
+        [pack_card(card) for card in game.waste],
+    ], separators=(',', ':'))
+
+
+class SolveCache:
+    """
+    Persistent cache of solved positions: proven win/loss plus the best known
+    line. Recently used entries are kept in an in-memory LRU in front of an
+    SQLite file, which several processes may read and write at once.
+
+    The version names whatever produced the results. Opening the cache with a
+    different version wipes it. Database errors are never raised: the cache
+    then behaves as if the entry was missing or the write was skipped, and the
+    database is tried again on the next call.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, version=None, max_entries=DEFAULT_MAX_ENTRIES,
+                 memory_entries=DEFAULT_MEMORY_ENTRIES):
+        self.version = version
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.touched = {}
+        self.last_flush = time.time()
+        self.ready = False
+
+        try:
+            self.db = sqlite3.connect(path, timeout=LOCK_TIMEOUT, isolation_level=None)
+        except sqlite3.Error:
+            self.db = None
+        self._prepare()
+
+    def _schema_ready(self):
+        names = {row[0] for row in self.db.execute("SELECT name FROM sqlite_master")}
+        if not SCHEMA_NAMES <= names:
+            return False
+        meta = dict(self.db.execute("SELECT name, value FROM meta"))
+        if 'count' not in meta:
+            return False
+        return self.version is None or meta.get('version') == self.version
+
+    def _prepare(self):
+        """
+        Make sure the tables exist and match the version. Only takes the write
+        lock when something has to change, and is retried on the next call if
+        another process holds the lock for too long.
+        """
+        if self.ready:
+            return True
+        if self.db is None:
+            return False
+        try:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            if self._schema_ready():
+                self.ready = True
+                return True
+
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS solved ("
+                    "state TEXT PRIMARY KEY, result TEXT NOT NULL, "
+                    "line TEXT NOT NULL, last_used REAL NOT NULL)")
+                self.db.execute("CREATE INDEX IF NOT EXISTS solved_last_used ON solved (last_used)")
+                self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+                # Keep the row count in meta, so put() can tell when to evict without a scan
+                self.db.execute(
+                    "CREATE TRIGGER IF NOT EXISTS solved_count_insert AFTER INSERT ON solved BEGIN "
+                    "UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE name = 'count'; END")
+                self.db.execute(
+                    "CREATE TRIGGER IF NOT EXISTS solved_count_delete AFTER DELETE ON solved BEGIN "
+                    "UPDATE meta SET value = CAST(value AS INTEGER) - 1 WHERE name = 'count'; END")
+                if self.version is not None:
+                    row = self.db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+                    if row is None or row[0] != self.version:
+                        self.db.execute("DELETE FROM solved")
+                        self.db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('version', ?)",
+                                        (self.version,))
+                self.db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('count', ?)",
+                                (self.db.execute("SELECT COUNT(*) FROM solved").fetchone()[0],))
+                self.db.execute("COMMIT")
+            except sqlite3.Error:
+                self.db.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            return False
+        self.ready = True
+        return True
+
+    def close(self):
+        if self.db is not None:
+            self.flush()
+            self.db.close()
+            self.db = None
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _touch(self, key):
+        self.touched[key] = time.time()
+        if len(self.touched) >= TOUCH_BATCH or time.time() - self.last_flush >= TOUCH_INTERVAL:
+            self.flush()
+
+    def _write_touched(self):
+        self.db.executemany("UPDATE solved SET last_used = ? WHERE state = ?",
+                            [(used, key) for key, used in self.touched.items()])
+
+    def flush(self):
+        """Write pending last-used times, so eviction keeps what is still in use"""
+        self.last_flush = time.time()
+        if not self.touched or not self._prepare():
+            return
+        try:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_touched()
+                self.db.execute("COMMIT")
+            except sqlite3.Error:
+                self.db.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            # Keep them for the next flush, but never more than the LRU holds
+            while len(self.touched) > self.memory_entries:
+                self.touched.pop(next(iter(self.touched)))
+            return
+        self.touched.clear()
+
+    def get(self, key):
+        """Returns (result, line) for a solved position, or None"""
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self._touch(key)
+            return self.memory[key]
+
+        if not self._prepare():
+            return None
+        try:
+            row = self.db.execute("SELECT result, line FROM solved WHERE state = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+
+        entry = (row[0], [tuple(move) for move in json.loads(row[1])])
+        self._remember(key, entry)
+        self._touch(key)
+        return entry
+
+    def put(self, key, result, line=()):
+        """Store a proven result, evicting the least recently used entries past the size cap"""
+        if result not in (RESULT_WIN, RESULT_LOSS):
+            raise ValueError(f"Unknown result: {result}")
+
+        line = [tuple(move) for move in line]
+        self._remember(key, (result, line))
+        if not self._prepare():
+            return
+        try:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                if self.version is not None:
+                    # Another process may have wiped the cache for a newer version
+                    row = self.db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+                    if row is None or row[0] != self.version:
+                        self.db.execute("ROLLBACK")
+                        self.ready = False
+                        return
+                self._write_touched()
+                # An upsert, unlike INSERT OR REPLACE, only fires the insert trigger for new rows
+                self.db.execute(
+                    "INSERT INTO solved (state, result, line, last_used) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (state) DO UPDATE SET result = excluded.result, "
+                    "line = excluded.line, last_used = excluded.last_used",
+                    (key, result, json.dumps(line), time.time()))
+                row = self.db.execute("SELECT value FROM meta WHERE name = 'count'").fetchone()
+                count = int(row[0]) if row else 0
+                if count > self.max_entries:
+                    self.db.execute(
+                        "DELETE FROM solved WHERE state IN ("
+                        "SELECT state FROM solved ORDER BY last_used ASC LIMIT ?)",
+                        (count - self.max_entries,))
+                self.db.execute("COMMIT")
+            except sqlite3.Error:
+                self.db.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            return
+        self.touched.clear()
+        self.last_flush = time.time()
+
+    def size(self):
+        """Number of positions stored on disk"""
+        if not self._prepare():
+            return 0
+        try:
+            return self.db.execute("SELECT COUNT(*) FROM solved").fetchone()[0]
+        except sqlite3.Error:
+            return 0